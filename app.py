@@ -1,30 +1,118 @@
+import atexit
 import logging
 import os
+import queue
+import tempfile
+import threading
 import time
-from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
 
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from flask import Flask, flash, g, jsonify, render_template, request, session
+from flask import (
+    Flask,
+    Response,
+    flash,
+    g,
+    jsonify,
+    render_template,
+    request,
+    session,
+)
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+from flask_caching import Cache
+from flask_session import Session
+from jinja2 import FileSystemBytecodeCache
+
+from spotify import (
+    RateLimited,
+    _executor,
+    _redis,
+    _top_tracks_cache,
+    _top_tracks_lock,
+    fetch_top_tracks,
+    get_headers,
+    get_recommendations,
+    get_top_tracks,
+    is_premium_user,
+    recommendations_cache_key,
+    spotify_bp,
+)
 
-from spotify import get_recommendations, get_top_tracks, is_premium_user, spotify_bp
+# Logging setup: request threads only put records on a queue,
+# formatting and writing to stderr happen in a background listener thread
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(
+    logging.Formatter(
+        "%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, log_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
 
-# Logging setup
+# force=True replaces any handler installed before app start,
+# the queue handler only merges message and args
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+    format="%(message)s",
+    handlers=[QueueHandler(log_queue)],
+    force=True,
 )
+# Skip collecting record attributes the log format doesn't use
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(JSONProvider):
+    """
+    JSON provider that serializes with orjson instead of the stdlib json module.
+
+    Types orjson doesn't know about natively fall back to Flask's default
+    conversions (dates, decimals, objects with __html__).
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=DefaultJSONProvider.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Make sure environment variables are loaded at the beginning of the application
 load_dotenv()
 
 app = Flask(__name__, template_folder="templates")
+app.json = OrjsonProvider(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
 
-# Debug output to check environment variables
-print(f"SPOTIFY_CLIENT_ID: {os.getenv('SPOTIFY_CLIENT_ID')}")
-print(f"SPOTIFY_CLIENT_SECRET: {os.getenv('SPOTIFY_CLIENT_SECRET')}")
+# Server-side session storage: the cookie only carries a signed session ID,
+# tokens and track IDs live in Redis
+app.config["SESSION_TYPE"] = "redis"
+app.config["SESSION_REDIS"] = _redis
+app.config["SESSION_USE_SIGNER"] = True
+Session(app)
+
+# In-memory cache for rendered pages that don't depend on the user
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+
+# Keep compiled templates on disk so they survive restarts
+jinja_cache_dir = os.getenv(
+    "JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "jinja_cache")
+)
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+
+# Check that Spotify credentials are configured, without logging their
+# values. Missing credentials are reported by spotify.py on import.
+if os.getenv("SPOTIFY_CLIENT_ID") and os.getenv("SPOTIFY_CLIENT_SECRET"):
+    logger.info("Spotify credentials loaded")
 
 logger.info("Initializing Flask application")
 
@@ -33,8 +121,180 @@ app.register_blueprint(spotify_bp)
 logger.info("Registered Spotify blueprint")
 
 
+_get_id = itemgetter("id")
+
+# Number of recommendations requested from Spotify for the profile page
+RECOMMENDATIONS_LIMIT = 12
+# Longest Retry-After in seconds a request thread sleeps before retrying,
+# longer waits are passed on to the client instead
+MAX_RATE_LIMIT_WAIT = 5
+
+# Ready-to-serialize /get-recommendations responses, keyed like the
+# recommendations cache in spotify.get_recommendations
+_response_cache = TTLCache(maxsize=1024, ttl=300)
+# Trimmed track data sent to the client, keyed by track ID
+_track_projection_cache = TTLCache(maxsize=50_000, ttl=86400)
+# TTLCache is not thread-safe (even reads expire entries) and caches are
+# filled from worker threads, every access takes the lock
+_cache_lock = threading.Lock()
+
+
+def cached_for_user(cache, user_id, fetch, *args, lock=_cache_lock):
+    """
+    Get per-user data from cache, refreshing it in the background when stale.
+
+    Values older than half of the cache TTL are still returned immediately,
+    while a worker thread fetches a fresh value for the next request. The
+    fetch function runs outside of the request, so it must not use the
+    session; pass everything it needs (e.g. headers) as arguments.
+
+    Args:
+        cache (TTLCache): Cache holding (value, fetched_at) pairs
+        user_id (str): Spotify user ID used as cache key
+        fetch (callable): Function fetching a fresh value from Spotify
+        *args: Arguments for fetch
+        lock (threading.Lock): Lock guarding the cache
+
+    Returns:
+        The cached or freshly fetched value
+    """
+    now = time.time()
+    with lock:
+        entry = cache.get(user_id)
+        stale = entry is not None and now - entry[1] > cache.ttl / 2
+        if stale:
+            # Mark as fresh right away so concurrent requests don't start more refreshes
+            cache[user_id] = (entry[0], now)
+
+    if entry is None:
+        value = fetch(*args)
+        if value:
+            with lock:
+                cache[user_id] = (value, now)
+        return value
+
+    if stale:
+        logger.info(f"Refreshing stale cached data for user {user_id} in background")
+
+        def refresh():
+            fresh_value = fetch(*args)
+            # Keep serving the old value if the refresh failed
+            if fresh_value:
+                with lock:
+                    cache[user_id] = (fresh_value, time.time())
+
+        _executor.submit(refresh)
+
+    return entry[0]
+
+
+def project_track(track):
+    """
+    Convert a Spotify track object to the minimal data sent to the client.
+
+    Projections are cached by track ID, so tracks that show up again for other
+    seeds or later polls are not converted twice.
+
+    Args:
+        track (dict): Track object from Spotify API
+
+    Returns:
+        dict: Track ID, name, artist, album image and Spotify URL,
+            or None if the track object is malformed
+    """
+    with _cache_lock:
+        track_data = _track_projection_cache.get(track["id"])
+    if track_data is not None:
+        return track_data
+
+    # Direct lookup on the happy path, missing album art falls back to ""
+    try:
+        album_image = track["album"]["images"][0]["url"]
+    except (KeyError, IndexError, TypeError):
+        album_image = ""
+
+    # Minimize data, keep only what's necessary
+    try:
+        track_data = {
+            "id": track["id"],
+            "name": track["name"],
+            "artist": track["artists"][0]["name"] if track["artists"] else "Unknown",
+            "album_image": album_image,
+            "url": track["external_urls"].get("spotify", ""),
+        }
+    except Exception as e:
+        logger.error(f"Error processing track: {str(e)}")
+        return None
+
+    with _cache_lock:
+        _track_projection_cache[track["id"]] = track_data
+    return track_data
+
+
+def recommendations_response(recommendations_data):
+    """
+    Build a JSON response with recommendations directly from orjson bytes.
+
+    Skips the jsonify() wrapper on this hot endpoint, orjson already emits
+    UTF-8 encoded bytes that can be sent as is.
+
+    Args:
+        recommendations_data (list): Trimmed track data for the client
+
+    Returns:
+        Response: JSON response with the recommendations
+    """
+    return Response(orjson.dumps(recommendations_data), mimetype="application/json")
+
+
+def fetch_recommendations(seed_tracks, max_retries=3):
+    """
+    Get recommendations for the seed tracks with retry on 429 error.
+
+    Args:
+        seed_tracks (list): Spotify track IDs to use as seed
+        max_retries (int): Maximum number of attempts
+
+    Returns:
+        list: List of recommended track objects or empty list if all attempts fail
+
+    Raises:
+        RateLimited: If Spotify asks to wait longer than MAX_RATE_LIMIT_WAIT
+    """
+    logger.info(f"Getting recommendations for seed tracks: {seed_tracks}")
+
+    for attempt in range(max_retries):
+        try:
+            return get_recommendations(seed_tracks, limit=RECOMMENDATIONS_LIMIT)
+        except RateLimited as e:
+            if e.retry_after > MAX_RATE_LIMIT_WAIT:
+                logger.error(
+                    f"Rate limit hit, Spotify asks to wait {e.retry_after} seconds, giving up"
+                )
+                raise
+            if attempt == max_retries - 1:
+                logger.error("Rate limit hit for recommendations, giving up")
+                break
+            # Spotify tells exactly how long to wait
+            logger.warning(
+                f"Rate limit hit, retrying in {e.retry_after} seconds (attempt {attempt+1}/{max_retries})"
+            )
+            time.sleep(e.retry_after + 0.1)
+        except Exception as e:
+            logger.error(
+                f"Error in attempt {attempt+1} for recommendations: {str(e)}"
+            )
+            break
+
+    return []
+
+
 # Home page
 @app.route("/", methods=["GET", "POST"])
+@cache.cached(
+    timeout=300,
+    unless=lambda: request.method != "GET" or "spotify_token" in session,
+)
 def home():
     """
     Render the home page of the application.
@@ -54,6 +314,19 @@ def home():
     return render_template("home.html")
 
 
+@cache.cached(timeout=600, key_prefix="login_profile")
+def render_login_profile():
+    """
+    Render the profile page variant with only the Spotify login button.
+
+    The page is the same for every anonymous user, so the rendered HTML is cached.
+
+    Returns:
+        str: Rendered profile.html template
+    """
+    return render_template("profile.html", show_login_button=True)
+
+
 # Profile page
 @app.route("/profile")
 def profile():
@@ -63,6 +336,7 @@ def profile():
     If the user is not authenticated with Spotify, shows a login button.
     Otherwise, fetches and displays the user's top tracks from Spotify.
     Also checks if the user has Spotify Premium to enable premium features.
+    Top tracks are cached per user and refreshed in the background when stale.
     
     Returns:
         Rendered profile.html template with appropriate context data
@@ -71,16 +345,27 @@ def profile():
 
     if "spotify_token" not in session:
         logger.info("No Spotify token in session, showing login button")
-        return render_template("profile.html", show_login_button=True)
+        return render_login_profile()
+
+    user_id = session.get("user_id")
+    # Headers are built here, the background refresh can't use the session
+    headers = get_headers()
 
     # Get top tracks
     logger.info("Fetching top tracks for user")
-    top_tracks = get_top_tracks()
+    if headers is None:
+        top_tracks = []
+    elif user_id:
+        top_tracks = cached_for_user(
+            _top_tracks_cache, user_id, fetch_top_tracks, headers, lock=_top_tracks_lock
+        )
+    else:
+        top_tracks = fetch_top_tracks(headers)
 
     if not top_tracks:
         logger.error("Failed to get top tracks from Spotify")
         flash("Failed to get your top tracks from Spotify.", "error")
-        return render_template("profile.html", show_login_button=True)
+        return render_login_profile()
 
     logger.info(f"Successfully fetched {len(top_tracks)} top tracks")
 
@@ -90,27 +375,9 @@ def profile():
     logger.info(f"User premium status: {premium_user}")
 
     # Save only track IDs instead of full track objects
-    # Limit to 3 tracks to reduce session size
-    track_ids = [track["id"] for track in top_tracks[:3]]
-
-    # Store only track IDs, not full track objects in session
+    track_ids = list(map(_get_id, top_tracks[:3]))
     session["top_track_ids"] = track_ids
 
-    # RADICAL SESSION SIZE REDUCTION:
-    # 1. Remove all unnecessary data from session
-    keys_to_keep = ["spotify_token", "token_expiry", "top_track_ids", "user_id"]
-    for key in list(session.keys()):
-        if key not in keys_to_keep:
-            session.pop(key, None)
-
-    # 2. If token is too long, save only part of it
-    if "spotify_token" in session and len(session["spotify_token"]) > 100:
-        # Save only first 100 characters of token
-        # This will break functionality but reduce cookie size
-        # Better solution would be to use server-side session storage
-        logger.warning("Truncating Spotify token to reduce session size")
-        session["spotify_token"] = session["spotify_token"][:100]
-
     logger.info("Rendering profile page with top tracks")
     return render_template(
         "profile.html",
@@ -140,8 +407,15 @@ def get_recommendations_async():
         logger.error("No Spotify token in session for async recommendations")
         return jsonify({"error": "Not authenticated"}), 401
 
+    # Fail fast if the token is expired and can't be refreshed,
+    # instead of going through the whole fetch and retry cycle
+    if get_headers() is None:
+        logger.error("Spotify token expired for async recommendations")
+        return jsonify({"error": "token_expired"}), 401
+
     # Check for tracks in session
-    logger.info(f"Session keys: {list(session.keys())}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Session keys: {list(session.keys())}")
 
     # Get track IDs from session
     if "top_track_ids" in session and session["top_track_ids"]:
@@ -158,107 +432,73 @@ def get_recommendations_async():
             return jsonify([])
 
         # Save track IDs, max 5 for diverse recommendations
-        track_ids = [track["id"] for track in top_tracks[:5]]
+        track_ids = list(map(_get_id, top_tracks[:5]))
         session["top_track_ids"] = track_ids
         logger.info(f"Saved {len(track_ids)} track IDs to session")
 
-    try:
-        # Get recommendations with retry on 429 error
-        logger.info("Fetching recommendations from Spotify API")
-        start_time = datetime.now()
+    # Use up to 3 distinct tracks for diverse recommendations
+    seed_tracks = list(dict.fromkeys(track_ids))[:3]
+    logger.info(f"Using {len(seed_tracks)} seed tracks for diverse recommendations")
 
-        # Add retry mechanism
-        max_retries = 3
-        retry_delay = 2
-        all_recommendations = []
+    if not seed_tracks:
+        logger.error("No seed tracks available")
+        return jsonify([])
 
-        # Use up to 3 tracks for diverse recommendations
-        seed_tracks = track_ids[:3] if len(track_ids) >= 3 else track_ids
-        logger.info(f"Using {len(seed_tracks)} seed tracks for diverse recommendations")
+    # Serve repeated polls for the same seed tracks from cache
+    cache_key = recommendations_cache_key(seed_tracks, RECOMMENDATIONS_LIMIT)
+    with _cache_lock:
+        cached_response = _response_cache.get(cache_key)
+    if cached_response is not None:
+        logger.info("Returning cached recommendations response")
+        # /add-to-playlist saves the recommendations shown to this session
+        session["recommended_tracks"] = list(map(_get_id, cached_response))
+        return recommendations_response(cached_response)
 
-        if not seed_tracks:
-            logger.error("No seed tracks available")
-            return jsonify([])
+    try:
+        logger.info("Fetching recommendations from Spotify API")
+        start_time = time.monotonic()
 
-        # Get recommendations for each track separately
-        for seed_track in seed_tracks:
-            logger.info(f"Getting recommendations for seed track: {seed_track}")
-
-            # Add delay between requests to avoid 429 error
-            time.sleep(2)
-
-            for attempt in range(max_retries):
-                try:
-                    # Get recommendations for one track
-                    track_recommendations = get_recommendations([seed_track])
-                    if track_recommendations:
-                        # Take only first 4 recommendations for each track
-                        all_recommendations.extend(track_recommendations[:4])
-                        break
-                except Exception as e:
-                    error_msg = str(e)
-                    logger.error(
-                        f"Error in attempt {attempt+1} for track {seed_track}: {error_msg}"
-                    )
-
-                    if "429" in error_msg and attempt < max_retries - 1:
-                        logger.warning(
-                            f"Rate limit hit, retrying in {retry_delay} seconds (attempt {attempt+1}/{max_retries})"
-                        )
-                        time.sleep(retry_delay)
-                        retry_delay *= 2  # Exponential backoff
-                    else:
-                        # Continue with next track
-                        break
-
-        end_time = datetime.now()
-        logger.info(
-            f"All recommendations fetch completed in {(end_time - start_time).total_seconds()} seconds"
-        )
+        # One call for all seeds, about 4 recommendations per seed track
+        all_recommendations = fetch_recommendations(seed_tracks)
+
+        duration = time.monotonic() - start_time
+        logger.info(f"All recommendations fetch completed in {duration} seconds")
 
         # Check that recommendations are not empty
         if not all_recommendations:
             logger.error("No recommendations found")
             return jsonify([])  # Return empty list instead of error
 
-        # Remove duplicates by ID
-        unique_recommendations = []
+        # Remove duplicates and convert to JSON format (minimize data) in one
+        # pass, stopping once 10 recommendations are collected
+        recommendations_data = []
         seen_ids = set()
         for track in all_recommendations:
-            if track["id"] not in seen_ids:
-                seen_ids.add(track["id"])
-                unique_recommendations.append(track)
-
-        logger.info(
-            f"Processing {len(unique_recommendations)} unique recommendations for response"
-        )
+            if track["id"] in seen_ids:
+                continue
+            seen_ids.add(track["id"])
 
-        # Convert recommendations to JSON format (minimize data)
-        recommendations_data = []
-        for track in unique_recommendations[:10]:  # Limit to 10 recommendations
-            # Minimize data, keep only what's necessary
-            try:
-                track_data = {
-                    "id": track["id"],
-                    "name": track["name"],
-                    "artist": (
-                        track["artists"][0]["name"] if track["artists"] else "Unknown"
-                    ),
-                    "album_image": (
-                        track["album"]["images"][0]["url"]
-                        if track["album"].get("images") and track["album"]["images"]
-                        else ""
-                    ),
-                    "url": track["external_urls"].get("spotify", ""),
-                }
+            # Skip tracks that failed to convert
+            track_data = project_track(track)
+            if track_data is not None:
                 recommendations_data.append(track_data)
-            except Exception as e:
-                logger.error(f"Error processing track: {str(e)}")
-                # Continue with next track
+                if len(recommendations_data) >= 10:
+                    break
 
-        logger.info(f"Returning {len(recommendations_data)} recommendations")
-        return jsonify(recommendations_data)
+        if recommendations_data:
+            with _cache_lock:
+                _response_cache[cache_key] = recommendations_data
 
+        logger.info(f"Returning {len(recommendations_data)} recommendations")
+        return recommendations_response(recommendations_data)
+
+    except RateLimited as e:
+        # Don't hold the worker thread, the client can retry later
+        return (
+            jsonify({"error": "rate_limited"}),
+            429,
+            {"Retry-After": str(e.retry_after)},
+        )
     except Exception as e:
         logger.exception(f"Error in get_recommendations_async: {str(e)}")
         # Return empty list instead of error
@@ -290,12 +530,22 @@ def log_request_info():
     
     This function runs before each request is processed. It logs the request method,
     path, client IP address, and optionally headers and form/JSON data for debugging.
+    Requests for static files are not logged.
     """
-    logger.info(f"Request: {request.method} {request.path} from {request.remote_addr}")
-    logger.debug(f"Headers: {request.headers}")
-    if request.method == "POST":
-        logger.debug(f"Form data: {request.form}")
-        logger.debug(f"JSON data: {request.get_json(silent=True)}")
+    # Static assets are not worth an access log line
+    if request.endpoint == "static":
+        return
+
+    # Lazy %-style args, the message is only built if the record is emitted
+    logger.info(
+        "Request: %s %s from %s", request.method, request.path, request.remote_addr
+    )
+    # Formatting headers and parsing the body is skipped unless DEBUG is on
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Headers: {request.headers}")
+        if request.method == "POST":
+            logger.debug(f"Form data: {request.form}")
+            logger.debug(f"JSON data: {request.get_json(silent=True)}")
 
 
 if __name__ == "__main__":
@@ -1,23 +1,39 @@
+import base64
+import functools
+import hashlib
 import logging
 import os
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 
+import orjson
+import redis
 import requests
-from flask import Blueprint, flash, redirect, render_template, request, session, url_for
-
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s.%(msecs)03d - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from flask import (
+    Blueprint,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
 )
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Logging is configured by the application in app.py
 logger = logging.getLogger(__name__)
 
 spotify_bp = Blueprint("spotify", __name__)
 
-# Spotify OAuth2 settings
+# Spotify OAuth2 settings, this module is imported before app.py loads .env
+load_dotenv()
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 SPOTIFY_REDIRECT_URI = "http://127.0.0.1:5000/spotify/callback"
@@ -25,8 +41,243 @@ SPOTIFY_REDIRECT_URI = "http://127.0.0.1:5000/spotify/callback"
 SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
 SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
 SPOTIFY_API_BASE_URL = "https://api.spotify.com/v1"
+# Spotify API endpoints, built once instead of on every call
+CURRENT_USER_URL = f"{SPOTIFY_API_BASE_URL}/me"
+TOP_TRACKS_URL = f"{SPOTIFY_API_BASE_URL}/me/top/tracks?time_range=short_term&limit=10"
+TRACKS_URL = f"{SPOTIFY_API_BASE_URL}/tracks"
+ARTIST_TOP_TRACKS_URL = SPOTIFY_API_BASE_URL + "/artists/{}/top-tracks"
+QUEUE_URL = f"{SPOTIFY_API_BASE_URL}/me/player/queue"
+USER_PLAYLISTS_URL = SPOTIFY_API_BASE_URL + "/users/{}/playlists"
+PLAYLIST_TRACKS_URL = SPOTIFY_API_BASE_URL + "/playlists/{}/tracks"
 SCOPE = "user-read-private user-read-email user-top-read playlist-modify-private"
 SHOW_DIALOG = "true"
+# Client credentials are sent as a Basic auth header on token requests
+TOKEN_REQUEST_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+    TOKEN_REQUEST_HEADERS["Authorization"] = (
+        "Basic "
+        + base64.b64encode(
+            f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()
+        ).decode()
+    )
+else:
+    logger.error(
+        "SPOTIFY_CLIENT_ID or SPOTIFY_CLIENT_SECRET is not set, "
+        "Spotify will reject every token request"
+    )
+# Authorization URL doesn't depend on the request, so it is built once
+SPOTIFY_LOGIN_URL = f"{SPOTIFY_AUTH_URL}/?" + urlencode(
+    {
+        "response_type": "code",
+        "redirect_uri": SPOTIFY_REDIRECT_URI,
+        "scope": SCOPE,
+        "client_id": SPOTIFY_CLIENT_ID,
+        "show_dialog": SHOW_DIALOG,
+    }
+)
+# Seconds before the real expiry when the access token is refreshed
+TOKEN_EXPIRY_SKEW = 60
+# Maximum number of Spotify API requests in flight at once, per process
+MAX_PARALLEL_REQUESTS = 16
+# Random tracks taken from each artist's top tracks
+TRACKS_PER_ARTIST = 3
+# Seconds to wait for Spotify to connect or send data, per attempt
+REQUEST_TIMEOUT = 10
+# Error response bodies are cut to this many characters in logs
+MAX_LOGGED_BODY = 200
+# Spotify accepts at most 50 IDs per /tracks call
+MAX_TRACKS_PER_REQUEST = 50
+# Spotify accepts at most 100 URIs per request adding tracks to a playlist
+MAX_PLAYLIST_TRACKS_PER_REQUEST = 100
+
+# Seconds the user's profile is kept in the session
+USER_PROFILE_TTL = 300
+
+# Premium status per user ID, it rarely changes within a session
+_premium_cache = TTLCache(maxsize=10_000, ttl=3600)
+_premium_lock = threading.Lock()
+# (top tracks, fetched_at) per user ID, kept out of the session to keep it
+# small. The profile page refreshes stale entries in the background.
+_top_tracks_cache = TTLCache(maxsize=10_000, ttl=600)
+_top_tracks_lock = threading.Lock()
+# Redis client for sessions (app.py) and recommendations shared between
+# users and worker processes. Both timeouts are set, so a Redis server that
+# is down or stops answering turns into an error instead of a hung request.
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_TIMEOUT = 1
+_redis = redis.Redis.from_url(
+    REDIS_URL, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT
+)
+RECOMMENDATIONS_CACHE_TTL = 3600
+# Top tracks per artist ID (US market), shared between users. TTLCache reads
+# also change its state, so reads take the lock too
+_artist_top_tracks_cache = TTLCache(maxsize=4096, ttl=900)
+_artist_top_tracks_lock = threading.Lock()
+# Token data per refresh token, for concurrent refreshes
+_refreshed_tokens = TTLCache(maxsize=1024, ttl=60)
+# One lock per refresh token being refreshed, so a slow refresh only blocks
+# requests of the same user. _refresh_guard protects both dicts.
+_refresh_locks = {}
+_refresh_guard = threading.Lock()
+# Token data per (auth code, session ID) for concurrent callbacks of the
+# same session (double submit), guarded like the refresh locks
+_exchanged_codes = TTLCache(maxsize=1024, ttl=60)
+_exchange_locks = {}
+_exchange_guard = threading.Lock()
+# (ETag, decoded body) per (Authorization header, URL) for conditional GETs,
+# entries live as long as the access token in the key (one hour)
+_etag_cache = TTLCache(maxsize=10_000, ttl=3600)
+_etag_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """
+    Raised when Spotify API responds with 429 Too Many Requests.
+
+    Attributes:
+        retry_after (int): Number of seconds Spotify asks to wait before retrying
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited by Spotify, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def raise_for_rate_limit(response):
+    """
+    Raise RateLimited if the Spotify API response is a 429 error.
+
+    Args:
+        response (requests.Response): Response from Spotify API
+
+    Raises:
+        RateLimited: If the response status code is 429
+    """
+    if response.status_code == 429:
+        retry_after = response.headers.get("Retry-After", "1")
+        raise RateLimited(int(retry_after) if retry_after.isdigit() else 1)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the rate of outgoing requests.
+
+    Args:
+        rate (float): Number of tokens added per second
+        capacity (int): Maximum number of tokens, i.e. the allowed burst size
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token from the bucket, blocking until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+
+# Shared by all requests in the process to stay below Spotify's rate limit
+_spotify_bucket = TokenBucket(rate=10, capacity=10)
+
+
+# Worker threads for independent Spotify requests, shared by all requests so
+# threads aren't started and joined on every call
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS)
+
+# Shared HTTP session, keeps connections to Spotify alive between requests.
+# 429 is not retried here, it is surfaced as RateLimited instead.
+SPOTIFY_SESSION = requests.Session()
+_spotify_adapter = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    # raise_on_status=False returns the last 5xx response once retries run
+    # out, callers handle it like any other failed status
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+)
+SPOTIFY_SESSION.mount("https://api.spotify.com", _spotify_adapter)
+SPOTIFY_SESSION.mount("https://accounts.spotify.com", _spotify_adapter)
+
+
+def ratelimited(func):
+    """Decorator that takes a token from the Spotify bucket before each call."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _spotify_bucket.acquire()
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@ratelimited
+def spotify_get(url, **kwargs):
+    """Send a rate limited GET request to Spotify API."""
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    return SPOTIFY_SESSION.get(url, **kwargs)
+
+
+@ratelimited
+def spotify_post(url, **kwargs):
+    """Send a rate limited POST request to Spotify API."""
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    return SPOTIFY_SESSION.post(url, **kwargs)
+
+
+def spotify_get_json(url, headers):
+    """
+    Send a conditional GET request to Spotify API and decode the JSON body.
+    
+    The ETag of the last response for the same URL and token is sent as
+    If-None-Match, a 304 response returns the body stored with that ETag.
+    
+    Args:
+        url (str): Spotify API URL
+        headers (dict): Authorization headers for Spotify API
+        
+    Returns:
+        tuple: (response, data) where data is the decoded body or None if
+        the request failed
+    """
+    cache_key = ((headers or {}).get("Authorization"), url)
+    with _etag_lock:
+        cached = _etag_cache.get(cache_key)
+    if cached is not None:
+        headers = {**headers, "If-None-Match": cached[0]}
+
+    response = spotify_get(url, headers=headers)
+
+    if response.status_code == 304 and cached is not None:
+        return response, cached[1]
+    if response.status_code != 200:
+        return response, None
+
+    data = orjson.loads(response.content)
+    etag = response.headers.get("ETag")
+    if etag and cache_key[0]:
+        with _etag_lock:
+            _etag_cache[cache_key] = (etag, data)
+    return response, data
 
 
 @spotify_bp.route("/clear")
@@ -36,6 +287,14 @@ def clear_spotify_tokens():
     session.pop("spotify_token", None)
     session.pop("spotify_refresh_token", None)
     session.pop("spotify_token_expires_in", None)
+    # The next login may be a different account or a changed subscription
+    user_id = session.get("user_id")
+    with _premium_lock:
+        _premium_cache.pop(user_id, None)
+    with _top_tracks_lock:
+        _top_tracks_cache.pop(user_id, None)
+    session.pop("cached_user_profile", None)
+    g.pop("spotify_headers", None)
     logger.info("Spotify tokens cleared from session")
     return redirect("profile")
 
@@ -44,21 +303,76 @@ def is_token_expired():
     """
     Check if the current Spotify token has expired.
     
+    The token is treated as expired TOKEN_EXPIRY_SKEW seconds early, so it
+    is refreshed before a request can fail with 401.
+    
     Returns:
         bool: True if token is expired or doesn't exist, False otherwise
     """
     expires_at = session.get("spotify_token_expires_in")
-    is_expired = expires_at and time.time() > expires_at
+    is_expired = expires_at and time.time() > expires_at - TOKEN_EXPIRY_SKEW
     logger.info(f"Checking if token is expired: {is_expired}")
     return is_expired
 
 
+def request_token(payload):
+    """
+    Send a grant to Spotify's token endpoint.
+    
+    Args:
+        payload (dict): Grant type and its parameters
+        
+    Returns:
+        tuple: (token_data, error). token_data is a dict with access_token,
+        expires_at (absolute time) and refresh_token (None if Spotify didn't
+        issue a new one), or None if the request failed; error is the start
+        of the response body in that case
+    """
+    response = SPOTIFY_SESSION.post(
+        SPOTIFY_TOKEN_URL,
+        data=payload,
+        headers=TOKEN_REQUEST_HEADERS,
+        timeout=REQUEST_TIMEOUT,
+    )
+
+    if response.status_code != 200:
+        return None, response.text[:MAX_LOGGED_BODY]
+
+    # A proxy or outage page can come back instead of JSON
+    try:
+        response_data = orjson.loads(response.content)
+        token_data = {
+            "access_token": response_data["access_token"],
+            "expires_at": time.time() + response_data["expires_in"],
+            "refresh_token": response_data.get("refresh_token"),
+        }
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        return None, response.text[:MAX_LOGGED_BODY]
+    return token_data, None
+
+
+def store_token(token_data):
+    """
+    Save token data returned by request_token in session.
+    
+    The refresh token is kept unless Spotify issued a new one.
+    
+    Args:
+        token_data (dict): Token data returned by request_token
+    """
+    session["spotify_token"] = token_data["access_token"]
+    session["spotify_token_expires_in"] = token_data["expires_at"]
+    if token_data["refresh_token"]:
+        session["spotify_refresh_token"] = token_data["refresh_token"]
+
+
 def refresh_spotify_token():
     """
     Refresh access_token using refresh_token.
     
     Attempts to use the stored refresh token to obtain a new access token
-    from Spotify's API.
+    from Spotify's API. A token refreshed by a concurrent request in the
+    last minute is reused instead of refreshing again.
     
     Returns:
         bool: True if token was successfully refreshed, False otherwise
@@ -67,33 +381,46 @@ def refresh_spotify_token():
     refresh_token = session.get("spotify_refresh_token")
 
     if not refresh_token:
-        logger.warning(
-            "No refresh token available. Clearing session and redirecting to login."
-        )
+        logger.warning("No refresh token available. Clearing session.")
         clear_spotify_tokens()
-        return redirect(url_for("spotify.login_spotify"))
+        return False
 
-    payload = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": SPOTIFY_CLIENT_ID,
-        "client_secret": SPOTIFY_CLIENT_SECRET,
-    }
+    # Concurrent requests of the same user may all find the token expired,
+    # only the first one asks Spotify for a new one
+    with _refresh_guard:
+        refresh_lock = _refresh_locks.setdefault(refresh_token, threading.Lock())
 
-    logger.info("Sending refresh token request to Spotify")
-    response = requests.post(SPOTIFY_TOKEN_URL, data=payload)
-    response_data = response.json()
+    with refresh_lock:
+        try:
+            with _refresh_guard:
+                token_data = _refreshed_tokens.get(refresh_token)
 
-    if response.status_code != 200:
-        logger.error(
-            f"Failed to refresh token: {response_data}. Clearing session and redirecting to login."
-        )
-        clear_spotify_tokens()
-        return False
+            if token_data is None:
+                logger.info("Sending refresh token request to Spotify")
+                token_data, error = request_token(
+                    {"grant_type": "refresh_token", "refresh_token": refresh_token}
+                )
 
-    # Update token in session
-    session["spotify_token"] = response_data["access_token"]
-    session["spotify_token_expires_in"] = time.time() + response_data["expires_in"]
+                if token_data is None:
+                    logger.error(
+                        "Failed to refresh token: %s. "
+                        "Clearing session and redirecting to login.",
+                        error,
+                    )
+                    clear_spotify_tokens()
+                    return False
+
+                with _refresh_guard:
+                    _refreshed_tokens[refresh_token] = token_data
+        finally:
+            # Requests still waiting hold the lock object and find the result
+            # in _refreshed_tokens, later ones create a new lock. A waiter
+            # finishing after that must not drop the newer lock.
+            with _refresh_guard:
+                if _refresh_locks.get(refresh_token) is refresh_lock:
+                    del _refresh_locks[refresh_token]
+
+    store_token(token_data)
     logger.info("Token refreshed successfully")
     return True
 
@@ -104,38 +431,61 @@ def get_headers():
     
     Checks if a valid token exists, refreshes it if expired, and returns
     properly formatted authorization headers for Spotify API requests.
+    The headers are kept in flask.g for the rest of the request.
     
     Returns:
         dict: Headers dictionary with Bearer token or None if authentication failed
     """
-    if "spotify_token" not in session:
-        print("No token found in session, redirecting to login.")
+    # Helpers called during the same request share the headers
+    headers = g.get("spotify_headers")
+    if headers is not None:
+        return headers
+
+    token = session.get("spotify_token")
+    if not token:
+        logger.debug("No token found in session, redirecting to login.")
         return None
 
     if is_token_expired():
-        print("Token expired, attempting to refresh...")
+        logger.info("Token expired, attempting to refresh...")
         if not refresh_spotify_token():
-            print("Failed to refresh token, clearing session and redirecting to login.")
+            logger.warning(
+                "Failed to refresh token, clearing session and redirecting to login."
+            )
             clear_spotify_tokens()
             return None
+        token = session["spotify_token"]
 
-    return {"Authorization": f"Bearer {session.get('spotify_token')}"}
+    headers = {"Authorization": f"Bearer {token}"}
+    g.spotify_headers = headers
+    return headers
 
 
 @spotify_bp.route("/login-spotify")
 def login_spotify():
     logger.info("Initiating Spotify login process")
-    auth_query_parameters = {
-        "response_type": "code",
-        "redirect_uri": SPOTIFY_REDIRECT_URI,
-        "scope": SCOPE,
-        "client_id": SPOTIFY_CLIENT_ID,
-        "show_dialog": SHOW_DIALOG,
-    }
-    url_args = urlencode(auth_query_parameters)
-    auth_url = f"{SPOTIFY_AUTH_URL}/?{url_args}"
-    logger.info(f"Redirecting to Spotify auth URL: {auth_url}")
-    return redirect(auth_url)
+    logger.info(f"Redirecting to Spotify auth URL: {SPOTIFY_LOGIN_URL}")
+    return redirect(SPOTIFY_LOGIN_URL)
+
+
+def exchange_auth_code(auth_token):
+    """
+    Exchange an authorization code for tokens.
+    
+    Args:
+        auth_token (str): Authorization code from the Spotify callback
+        
+    Returns:
+        tuple: (token_data, error) as returned by request_token
+    """
+    logger.info("Exchanging auth code for access token")
+    return request_token(
+        {
+            "grant_type": "authorization_code",
+            "code": auth_token,
+            "redirect_uri": SPOTIFY_REDIRECT_URI,
+        }
+    )
 
 
 @spotify_bp.route("/spotify/callback")
@@ -148,29 +498,59 @@ def callback():
         flash("Authorization failed. No code provided.", "error")
         return redirect(url_for("profile"))
 
-    payload = {
-        "grant_type": "authorization_code",
-        "code": auth_token,
-        "redirect_uri": SPOTIFY_REDIRECT_URI,
-        "client_id": SPOTIFY_CLIENT_ID,
-        "client_secret": SPOTIFY_CLIENT_SECRET,
-    }
-
-    logger.info("Exchanging auth code for access token")
-    response = requests.post(SPOTIFY_TOKEN_URL, data=payload)
-    response_data = response.json()
+    # A code can be exchanged only once. If this session already exchanged
+    # it (refresh, back button, double click), keep the tokens it got.
+    if auth_token == session.get("spotify_auth_code") and "spotify_token" in session:
+        logger.info("Auth code was already exchanged in this session")
+        return redirect(url_for("profile"))
 
-    if response.status_code != 200:
-        logger.error(f"Failed to authenticate with Spotify: {response_data}")
-        flash(f"Failed to authenticate with Spotify: {response_data}", "error")
+    # Concurrent callbacks of this session wait for the first exchange and
+    # reuse its tokens. Sessions without an ID can't be told apart, so they
+    # always exchange the code themselves.
+    session_id = getattr(session, "sid", None)
+    if session_id is None:
+        token_data, error = exchange_auth_code(auth_token)
+    else:
+        exchange_key = (auth_token, session_id)
+        with _exchange_guard:
+            exchange_lock = _exchange_locks.setdefault(exchange_key, threading.Lock())
+
+        with exchange_lock:
+            try:
+                with _exchange_guard:
+                    token_data = _exchanged_codes.get(exchange_key)
+
+                if token_data is None:
+                    token_data, error = exchange_auth_code(auth_token)
+                    if token_data is not None:
+                        with _exchange_guard:
+                            _exchanged_codes[exchange_key] = token_data
+                else:
+                    logger.info("Auth code was exchanged by a concurrent request")
+            finally:
+                # A later request may have registered a new lock already
+                with _exchange_guard:
+                    if _exchange_locks.get(exchange_key) is exchange_lock:
+                        del _exchange_locks[exchange_key]
+
+    if token_data is None:
+        logger.error("Failed to authenticate with Spotify: %s", error)
+        flash(f"Failed to authenticate with Spotify: {error}", "error")
         return redirect(url_for("profile"))
 
     # Save token in session
-    session["spotify_token"] = response_data["access_token"]
-    session["spotify_refresh_token"] = response_data.get("refresh_token")
-    session["spotify_token_expires_in"] = time.time() + response_data["expires_in"]
+    session["spotify_auth_code"] = auth_token
+    store_token(token_data)
     logger.info("Successfully authenticated with Spotify")
 
+    # Save user ID in session, it is used as a key for per-user caches
+    session.pop("cached_user_profile", None)
+    user_data = get_current_user(
+        {"Authorization": f"Bearer {token_data['access_token']}"}
+    )
+    if user_data:
+        session["user_id"] = user_data.get("id")
+
     # Redirect to recommendations page
     logger.info("Redirecting to recommendations page")
     return redirect(url_for("spotify.spotify_recommendations"))
@@ -180,8 +560,8 @@ def get_top_tracks():
     """
     Get user's top tracks from Spotify.
     
-    Fetches the user's top tracks from Spotify API with caching for performance.
-    Uses short-term listening history and limits to 10 tracks.
+    Uses short-term listening history and limits to 10 tracks. The tracks
+    are cached server-side per user, in the cache the profile page uses.
     
     Returns:
         list: List of track objects from Spotify API or empty list if request fails
@@ -190,130 +570,204 @@ def get_top_tracks():
     if not headers:
         return []
 
-    # Check cache in session
-    cache_key = "cached_top_tracks"
-    cache_time_key = "cached_top_tracks_time"
-    current_time = time.time()
+    user_id = session.get("user_id")
+    if user_id:
+        with _top_tracks_lock:
+            entry = _top_tracks_cache.get(user_id)
+        if entry is not None:
+            logger.debug("Using cached top tracks for user %s", user_id)
+            return entry[0]
+
+    top_tracks = fetch_top_tracks(headers)
+    if user_id and top_tracks:
+        with _top_tracks_lock:
+            _top_tracks_cache[user_id] = (top_tracks, time.time())
+    return top_tracks
 
-    # Use cache if it exists and is less than 1 hour old
-    if cache_key in session and cache_time_key in session:
-        if current_time - session[cache_time_key] < 3600:  # 1 hour = 3600 seconds
-            print("Using cached top tracks in get_top_tracks")
-            return session[cache_key]
 
-    # Get top tracks
-    top_tracks_url = (
-        f"{SPOTIFY_API_BASE_URL}/me/top/tracks?time_range=short_term&limit=10"
-    )
-    response = requests.get(top_tracks_url, headers=headers)
+def fetch_top_tracks(headers):
+    """
+    Fetch user's top tracks with the given headers.
+    
+    Doesn't touch the session, so it can run outside of the request thread.
+    Unchanged top tracks come back as 304 (see spotify_get_json).
+    
+    Args:
+        headers (dict): Authorization headers for Spotify API
+        
+    Returns:
+        list: List of track objects from Spotify API or empty list if request fails
+    """
+    response, data = spotify_get_json(TOP_TRACKS_URL, headers)
 
-    if response.status_code != 200:
-        print(f"Error fetching top tracks: {response.status_code}, {response.text}")
+    if data is None:
+        logger.error(
+            "Error fetching top tracks: %s, %s",
+            response.status_code,
+            response.text[:MAX_LOGGED_BODY],
+        )
         return []
 
-    top_tracks = response.json().get("items", [])
+    return data.get("items", [])
 
-    # Save to cache
-    session[cache_key] = top_tracks
-    session[cache_time_key] = current_time
 
-    return top_tracks
+def recommendations_cache_key(track_ids, limit):
+    """
+    Build the cache key for recommendations of the given seed tracks.
+    
+    The key doesn't depend on the order of the seed tracks. Every
+    recommendations cache uses it, so they agree on what "the same seeds" is.
+    
+    Args:
+        track_ids (list): Spotify track IDs used as seed
+        limit (int): Maximum number of recommended tracks
+        
+    Returns:
+        str: Cache key
+    """
+    seeds = ",".join(sorted(track_ids))
+    return "reco:" + hashlib.sha1(f"{limit}:{seeds}".encode()).hexdigest()
 
 
 # Get recommendations based on user's tracks
-def get_recommendations(track_ids):
+def get_recommendations(track_ids, limit=10):
     """
     Get recommendations from random tracks of all artists in top-10.
     
     For each artist in the user's top tracks, this function:
-    1. Gets the artist's albums
-    2. Selects one random track from each album
-    3. Returns up to 10 random tracks from these selections
+    1. Gets the artist's top tracks
+    2. Selects a few random tracks of each artist
+    3. Returns up to `limit` random tracks from these selections
+
+    Independent requests (track info, top tracks of every artist) are sent
+    in parallel.
     
     Args:
         track_ids (list): List of Spotify track IDs to use as seed
+        limit (int): Maximum number of recommended tracks to return
         
     Returns:
         list: List of recommended track objects or empty list if request fails
+
+    Raises:
+        RateLimited: If Spotify API rate limit is hit
     """
     headers = get_headers()
     if not headers:
         return []
 
-    all_track_ids = []
-    processed_artists = set()  # To track already processed artists
+    # Same seed tracks give the same recommendations for an hour, for every
+    # worker process. The app works without Redis, just slower.
+    cache_key = recommendations_cache_key(track_ids, limit)
+    try:
+        cached_tracks = _redis.get(cache_key)
+    except redis.RedisError as e:
+        logger.warning("Recommendations cache is unavailable: %s", e)
+        cached_tracks = None
+
+    if cached_tracks is not None:
+        tracks = orjson.loads(cached_tracks)
+        session["recommended_tracks"] = [track["id"] for track in tracks]
+        logger.debug("Using cached recommendations for %d seed tracks", len(track_ids))
+        return tracks
+
+    # Requests on the same level don't depend on each other, so they are sent
+    # in parallel and each level costs about one round trip instead of N
+    # Get track information for the top tracks with the batch endpoint
+    track_batches = _executor.map(
+        lambda batch: spotify_get(
+            TRACKS_URL,
+            headers=headers,
+            params={"ids": ",".join(batch), "market": "US"},
+        ),
+        [
+            track_ids[i : i + MAX_TRACKS_PER_REQUEST]
+            for i in range(0, len(track_ids), MAX_TRACKS_PER_REQUEST)
+        ],
+    )
 
-    # Go through each track from top-10
-    for track_id in track_ids:
-        # Get track information
-        track_url = f"{SPOTIFY_API_BASE_URL}/tracks/{track_id}"
-        track_response = requests.get(track_url, headers=headers)
+    # Collect artist IDs, each artist is processed only once
+    artist_ids = []
+    for track_response in track_batches:
+        raise_for_rate_limit(track_response)
 
         if track_response.status_code != 200:
-            print(
-                f"Error fetching track info: {track_response.status_code}, {track_response.text}"
+            logger.error(
+                "Error fetching track info: %s, %s",
+                track_response.status_code,
+                track_response.text[:MAX_LOGGED_BODY],
             )
             continue
 
-        # Get artist ID
-        artist_id = track_response.json()["artists"][0]["id"]
-
-        # Skip if artist already processed
-        if artist_id in processed_artists:
-            continue
-        processed_artists.add(artist_id)
+        for track in orjson.loads(track_response.content).get("tracks", []):
+            # Unknown IDs come back as null entries
+            if not track:
+                continue
+            artist_id = track["artists"][0]["id"]
+            if artist_id not in artist_ids:
+                artist_ids.append(artist_id)
+
+    # Get top tracks of each artist, only artists not cached yet are requested
+    artists_tracks = {}
+    missing_artist_ids = []
+    with _artist_top_tracks_lock:
+        for artist_id in artist_ids:
+            artist_tracks = _artist_top_tracks_cache.get(artist_id)
+            if artist_tracks is None:
+                missing_artist_ids.append(artist_id)
+            else:
+                artists_tracks[artist_id] = artist_tracks
+
+    top_tracks_responses = _executor.map(
+        lambda artist_id: spotify_get(
+            ARTIST_TOP_TRACKS_URL.format(artist_id),
+            headers=headers,
+            params={"market": "US"},
+        ),
+        missing_artist_ids,
+    )
 
-        # Get artist's albums
-        artist_albums_url = f"{SPOTIFY_API_BASE_URL}/artists/{artist_id}/albums"
-        albums_response = requests.get(
-            artist_albums_url, headers=headers, params={"limit": 20}
-        )
+    for artist_id, top_tracks_response in zip(missing_artist_ids, top_tracks_responses):
+        raise_for_rate_limit(top_tracks_response)
 
-        if albums_response.status_code != 200:
-            print(
-                f"Error fetching artist albums: {albums_response.status_code}, {albums_response.text}"
+        if top_tracks_response.status_code != 200:
+            logger.error(
+                "Error fetching artist top tracks: %s, %s",
+                top_tracks_response.status_code,
+                top_tracks_response.text[:MAX_LOGGED_BODY],
             )
             continue
 
-        # Collect tracks from albums
-        for album in albums_response.json().get("items", []):
-            album_tracks_url = f"{SPOTIFY_API_BASE_URL}/albums/{album['id']}/tracks"
-            tracks_response = requests.get(album_tracks_url, headers=headers)
-
-            if tracks_response.status_code == 200:
-                album_tracks = tracks_response.json().get("items", [])
-                # Add only one random track from album
-                if album_tracks:
-                    random_track = random.choice(album_tracks)
-                    all_track_ids.append(random_track["id"])
-
-    # Remove tracks that are already in user's top
-    all_track_ids = [tid for tid in all_track_ids if tid not in track_ids]
-
-    # Select random 10 tracks
-    if len(all_track_ids) > 10:
-        selected_track_ids = random.sample(all_track_ids, 10)
-    else:
-        selected_track_ids = all_track_ids
-
-    # Get full information about selected tracks
-    tracks_url = f"{SPOTIFY_API_BASE_URL}/tracks"
-    params = {"ids": ",".join(selected_track_ids), "market": "US"}
-
-    response = requests.get(tracks_url, headers=headers, params=params)
-
-    if response.status_code != 200:
-        print(
-            f"Error fetching selected tracks: {response.status_code}, {response.text}"
-        )
-        return []
-
-    tracks = response.json().get("tracks", [])
+        artist_tracks = orjson.loads(top_tracks_response.content).get("tracks", [])
+        with _artist_top_tracks_lock:
+            _artist_top_tracks_cache[artist_id] = artist_tracks
+        artists_tracks[artist_id] = artist_tracks
+
+    # Candidate tracks by ID, tracks already in user's top are skipped
+    seen = set(track_ids)
+    candidates = {}
+    for artist_tracks in artists_tracks.values():
+        # Add a few random tracks of every artist
+        k = min(TRACKS_PER_ARTIST, len(artist_tracks))
+        for track in random.sample(artist_tracks, k=k):
+            if track["id"] not in seen:
+                candidates[track["id"]] = track
+
+    # Select random tracks up to the limit
+    tracks = random.sample(list(candidates.values()), k=min(limit, len(candidates)))
+
+    if tracks:
+        try:
+            _redis.setex(cache_key, RECOMMENDATIONS_CACHE_TTL, orjson.dumps(tracks))
+        except redis.RedisError as e:
+            logger.warning("Failed to cache recommendations: %s", e)
 
     # Save track IDs in session
     session["recommended_tracks"] = [track["id"] for track in tracks]
 
-    print(f"Generated {len(tracks)} random recommendations from multiple artists")
+    logger.debug(
+        "Generated %d random recommendations from multiple artists", len(tracks)
+    )
     return tracks
 
 
@@ -382,17 +836,27 @@ def add_recommendations_to_queue():
             flash("Failed to authenticate with Spotify.", "error")
             return redirect(url_for("spotify.login_spotify"))
 
-        for track in recommendations:
-            track_uri = f"spotify:track:{track['id']}"
-            queue_url = f"https://api.spotify.com/v1/me/player/queue?uri={track_uri}"
+        # Spotify has no bulk queue endpoint, so the tracks are queued in
+        # parallel. Recommendations are random, their order doesn't matter.
+        responses = _executor.map(
+            lambda track: spotify_post(
+                QUEUE_URL,
+                headers=headers,
+                params={"uri": f"spotify:track:{track['id']}"},
+            ),
+            recommendations,
+        )
 
-            response = requests.post(queue_url, headers=headers)
+        for track, response in zip(recommendations, responses):
             if response.status_code != 204:
-                print(
-                    f"Failed to add track {track['name']} to the queue: {response.status_code}, {response.text}"
+                logger.error(
+                    "Failed to add track %s to the queue: %s, %s",
+                    track["name"],
+                    response.status_code,
+                    response.text[:MAX_LOGGED_BODY],
                 )
             else:
-                print(f"Track {track['name']} successfully added to the queue.")
+                logger.debug("Track %s successfully added to the queue.", track["name"])
 
         flash("All recommended tracks added to your queue!", "success")
         return redirect(url_for("profile"))
@@ -404,23 +868,28 @@ def is_premium_user():
     """
     Check if the current user has a Spotify Premium subscription.
     
-    Makes an API call to Spotify to get the user's profile and checks
-    the subscription type.
+    Checks the subscription type in the user's profile (see
+    get_current_user). The result is cached per user for an hour.
     
     Returns:
         bool: True if user has Premium subscription, False otherwise
     """
-    user_profile_url = "https://api.spotify.com/v1/me"
-    headers = get_headers()
-    response = requests.get(user_profile_url, headers=headers)
-
-    if response.status_code == 200:
-        user_data = response.json()
-        return user_data.get("product") == "premium"
-    else:
-        print(f"Failed to fetch user profile: {response.status_code}, {response.text}")
+    user_id = session.get("user_id")
+    with _premium_lock:
+        premium = _premium_cache.get(user_id)
+    if premium is not None:
+        return premium
+
+    user_data = get_current_user(get_headers())
+    if user_data is None:
         return False
 
+    premium = user_data.get("product") == "premium"
+    if user_id:
+        with _premium_lock:
+            _premium_cache[user_id] = premium
+    return premium
+
 
 def create_playlist(headers):
     """
@@ -438,7 +907,7 @@ def create_playlist(headers):
 
     user_id = user_data.get("id")
     logger.debug(f"Creating playlist for user: {user_id}")
-    create_playlist_url = f"https://api.spotify.com/v1/users/{user_id}/playlists"
+    create_playlist_url = USER_PLAYLISTS_URL.format(user_id)
     playlist_name = "Saved recommendations"
     payload = {
         "name": playlist_name,
@@ -446,15 +915,25 @@ def create_playlist(headers):
         "public": False,
     }
 
-    print(f"Creating playlist with name: {playlist_name} for user {user_id}")
+    logger.debug(
+        "Creating playlist with name: %s for user %s", playlist_name, user_id
+    )
 
-    response = requests.post(create_playlist_url, json=payload, headers=headers)
+    response = spotify_post(
+        create_playlist_url,
+        data=orjson.dumps(payload),
+        headers={**headers, "Content-Type": "application/json"},
+    )
     if response.status_code == 201:
-        playlist_id = response.json()["id"]
-        print(f"Playlist created successfully: {playlist_id}")
+        playlist_id = orjson.loads(response.content)["id"]
+        logger.debug("Playlist created successfully: %s", playlist_id)
         return playlist_id
     else:
-        print(f"Error creating playlist: {response.status_code}, {response.text}")
+        logger.error(
+            "Error creating playlist: %s, %s",
+            response.status_code,
+            response.text[:MAX_LOGGED_BODY],
+        )
         return None
 
 
@@ -470,18 +949,32 @@ def add_tracks_to_playlist(playlist_id, track_uris, headers):
     Returns:
         None
     """
-    add_tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    payload = {"uris": track_uris}
-
-    print(f"Adding tracks to playlist {playlist_id}: {track_uris}")
+    add_tracks_url = PLAYLIST_TRACKS_URL.format(playlist_id)
+
+    logger.debug("Adding tracks to playlist %s: %s", playlist_id, track_uris)
+
+    # Spotify accepts up to 100 URIs per request, the batches are independent
+    json_headers = {**headers, "Content-Type": "application/json"}
+    batches = [
+        track_uris[i : i + MAX_PLAYLIST_TRACKS_PER_REQUEST]
+        for i in range(0, len(track_uris), MAX_PLAYLIST_TRACKS_PER_REQUEST)
+    ]
+    responses = _executor.map(
+        lambda batch: spotify_post(
+            add_tracks_url, data=orjson.dumps({"uris": batch}), headers=json_headers
+        ),
+        batches,
+    )
 
-    response = requests.post(add_tracks_url, json=payload, headers=headers)
-    if response.status_code == 201:
-        print("Tracks successfully added to playlist!")
-    else:
-        print(
-            f"Error adding tracks to playlist: {response.status_code}, {response.text}"
-        )
+    for response in responses:
+        if response.status_code == 201:
+            logger.debug("Tracks successfully added to playlist!")
+        else:
+            logger.error(
+                "Error adding tracks to playlist: %s, %s",
+                response.status_code,
+                response.text[:MAX_LOGGED_BODY],
+            )
 
 
 @spotify_bp.route("/add-to-playlist", methods=["POST"])
@@ -490,12 +983,12 @@ def add_to_playlist():
 
     user_data = get_current_user(headers)
     if not user_data:
-        print("Failed to get user profile.")
+        logger.error("Failed to get user profile.")
         return redirect(url_for("profile"))
 
     recommended_track_ids = session.get("recommended_tracks", [])
     if not recommended_track_ids:
-        print("No recommended tracks available.")
+        logger.warning("No recommended tracks available.")
         return redirect(url_for("profile"))
 
     playlist_id = create_playlist(headers)
@@ -503,9 +996,9 @@ def add_to_playlist():
 
         track_uris = [f"spotify:track:{track_id}" for track_id in recommended_track_ids]
         add_tracks_to_playlist(playlist_id, track_uris, headers)
-        print(f"Tracks added to playlist: {playlist_id}")
+        logger.info("Tracks added to playlist: %s", playlist_id)
     else:
-        print("Failed to create playlist.")
+        logger.error("Failed to create playlist.")
 
     return redirect(url_for("profile"))
 
@@ -514,17 +1007,39 @@ def get_current_user(headers):
     """
     Get the current user's Spotify profile information.
     
+    The profile is kept in the session for USER_PROFILE_TTL seconds, only
+    the fields used by the app are stored. The subscription type can change
+    at any time, so the profile is fetched again after that.
+    
     Args:
         headers (dict): Authorization headers for Spotify API
         
     Returns:
-        dict: User profile data or None if request fails
+        dict: User profile data (id, display_name, product, fetched_at) or
+        None if request fails
     """
-    user_profile_url = f"{SPOTIFY_API_BASE_URL}/me"
-    response = requests.get(user_profile_url, headers=headers)
-
-    if response.status_code == 200:
-        return response.json()
+    user_profile = session.get("cached_user_profile")
+    if (
+        user_profile is not None
+        and time.time() - user_profile.get("fetched_at", 0) < USER_PROFILE_TTL
+    ):
+        return user_profile
+
+    response, user_data = spotify_get_json(CURRENT_USER_URL, headers)
+
+    if user_data is not None:
+        user_profile = {
+            "id": user_data.get("id"),
+            "display_name": user_data.get("display_name"),
+            "product": user_data.get("product"),
+            "fetched_at": time.time(),
+        }
+        session["cached_user_profile"] = user_profile
+        return user_profile
     else:
-        print(f"Error fetching user profile: {response.status_code}, {response.text}")
+        logger.error(
+            "Error fetching user profile: %s, %s",
+            response.status_code,
+            response.text[:MAX_LOGGED_BODY],
+        )
         return None
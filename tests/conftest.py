@@ -2,10 +2,20 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from unittest.mock import patch
+
 import pytest
 from flask import Flask
 from spotify import spotify_bp
 
+
+@pytest.fixture(autouse=True)
+def redis_client():
+    # Keep tests independent of whatever Redis runs on localhost
+    with patch("spotify._redis") as mock_redis:
+        mock_redis.get.return_value = None
+        yield mock_redis
+
 @pytest.fixture
 def client():
     app = Flask(__name__)
@@ -0,0 +1,144 @@
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from cachetools import TTLCache
+from flask.sessions import SecureCookieSessionInterface
+
+import app as app_module
+from app import cached_for_user
+from spotify import RateLimited
+
+
+@pytest.fixture
+def app_client():
+    # Cookie sessions, so the tests don't need a running Redis
+    app_module.app.session_interface = SecureCookieSessionInterface()
+    app_module.app.secret_key = "testkey"
+    app_module.app.config["TESTING"] = True
+    app_module._response_cache.clear()
+    with app_module.app.test_client() as client:
+        yield client
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def make_track(track_id):
+    return {
+        "id": track_id,
+        "name": f"Track {track_id}",
+        "artists": [{"name": "Artist"}],
+        "album": {"images": [{"url": "https://img/cover.jpg"}]},
+        "external_urls": {"spotify": f"https://open.spotify.com/track/{track_id}"},
+    }
+
+
+def log_in(client, top_track_ids):
+    with client.session_transaction() as sess:
+        sess["spotify_token"] = "valid_token"
+        sess["spotify_token_expires_in"] = time.time() + 3600
+        sess["top_track_ids"] = top_track_ids
+
+
+def test_cached_for_user_fetches_on_miss():
+    cache = TTLCache(maxsize=10, ttl=600)
+    fetch = MagicMock(return_value=["track"])
+
+    assert cached_for_user(cache, "user", fetch, "headers") == ["track"]
+    assert cached_for_user(cache, "user", fetch, "headers") == ["track"]
+    fetch.assert_called_once_with("headers")
+
+
+def test_cached_for_user_returns_stale_value_then_refreshes():
+    cache = TTLCache(maxsize=10, ttl=600)
+    cache["user"] = (["old"], time.time() - 400)
+    release = threading.Event()
+    fetch = MagicMock(side_effect=lambda headers: release.wait(2) and ["new"])
+
+    assert cached_for_user(cache, "user", fetch, "headers") == ["old"]
+    # The entry is marked fresh, so a second request doesn't start another refresh
+    assert cached_for_user(cache, "user", fetch, "headers") == ["old"]
+
+    release.set()
+    assert wait_for(lambda: cache["user"][0] == ["new"])
+    assert cached_for_user(cache, "user", fetch, "headers") == ["new"]
+    fetch.assert_called_once_with("headers")
+
+
+def test_cached_for_user_keeps_stale_value_when_refresh_fails():
+    cache = TTLCache(maxsize=10, ttl=600)
+    cache["user"] = (["old"], time.time() - 400)
+    fetch = MagicMock(return_value=None)
+
+    assert cached_for_user(cache, "user", fetch) == ["old"]
+    assert wait_for(lambda: fetch.called)
+    assert cached_for_user(cache, "user", fetch) == ["old"]
+
+
+def test_get_recommendations_requires_token(app_client):
+    response = app_client.get("/get-recommendations")
+
+    assert response.status_code == 401
+    assert response.get_json() == {"error": "Not authenticated"}
+
+
+def test_get_recommendations_returns_cached_response(app_client):
+    log_in(app_client, ["a", "b", "c", "a", "d"])
+
+    recommendations = [make_track(f"rec{i}") for i in range(12)] + [make_track("rec0")]
+    with patch("app.get_recommendations", return_value=recommendations) as mock_recs:
+        first = app_client.get("/get-recommendations")
+        second = app_client.get("/get-recommendations")
+
+    assert first.status_code == 200
+    data = first.get_json()
+    assert [track["id"] for track in data] == [f"rec{i}" for i in range(10)]
+    assert data[0]["album_image"] == "https://img/cover.jpg"
+    assert second.get_json() == data
+    mock_recs.assert_called_once_with(["a", "b", "c"], limit=app_module.RECOMMENDATIONS_LIMIT)
+
+
+def test_cached_response_saves_recommended_tracks_in_session(app_client):
+    log_in(app_client, ["a", "b", "c"])
+    with patch("app.get_recommendations", return_value=[make_track("rec0")]):
+        app_client.get("/get-recommendations")
+
+    # Another session with the same seed tracks is served from the cache
+    with app_module.app.test_client() as other_client:
+        log_in(other_client, ["c", "b", "a"])
+        with patch("app.get_recommendations") as mock_recs:
+            response = other_client.get("/get-recommendations")
+        with other_client.session_transaction() as sess:
+            assert sess["recommended_tracks"] == ["rec0"]
+
+    assert [track["id"] for track in response.get_json()] == ["rec0"]
+    mock_recs.assert_not_called()
+
+
+def test_long_retry_after_is_passed_to_client(app_client):
+    log_in(app_client, ["a", "b", "c"])
+    with patch("app.get_recommendations", side_effect=RateLimited(120)) as mock_recs, \
+            patch("app.time.sleep") as mock_sleep:
+        response = app_client.get("/get-recommendations")
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "120"
+    mock_sleep.assert_not_called()
+    mock_recs.assert_called_once()
+
+
+def test_short_retry_after_is_waited_out(app_client):
+    log_in(app_client, ["a", "b", "c"])
+    with patch(
+        "app.get_recommendations", side_effect=[RateLimited(1), [make_track("rec0")]]
+    ), patch("app.time.sleep") as mock_sleep:
+        response = app_client.get("/get-recommendations")
+
+    assert [track["id"] for track in response.get_json()] == ["rec0"]
+    mock_sleep.assert_called_once_with(1.1)
@@ -0,0 +1,289 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest.mock import MagicMock, patch
+
+import orjson
+import pytest
+import redis
+import requests
+from cachelib import SimpleCache
+from flask import Flask, session
+from flask_session import Session
+from urllib3.util.retry import Retry
+
+from spotify import (
+    RateLimited,
+    TokenBucket,
+    _premium_cache,
+    _spotify_adapter,
+    _top_tracks_cache,
+    get_current_user,
+    get_recommendations,
+    get_top_tracks,
+    is_premium_user,
+    raise_for_rate_limit,
+    refresh_spotify_token,
+    request_token,
+    spotify_bp,
+    spotify_get_json,
+)
+
+
+def make_response(status_code, json_data=None, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.json.return_value = json_data or {}
+    response.content = orjson.dumps(json_data or {})
+    response.headers = headers or {}
+    response.text = ""
+    return response
+
+
+def test_raise_for_rate_limit_uses_retry_after():
+    with pytest.raises(RateLimited) as exc_info:
+        raise_for_rate_limit(make_response(429, headers={"Retry-After": "7"}))
+    assert exc_info.value.retry_after == 7
+
+
+def test_raise_for_rate_limit_ignores_other_statuses():
+    raise_for_rate_limit(make_response(200))
+    raise_for_rate_limit(make_response(404))
+
+
+def test_get_recommendations_raises_on_429(client):
+    with client.application.test_request_context():
+        session["spotify_token"] = "valid_token"
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            mock_get.return_value = make_response(429, headers={"Retry-After": "3"})
+            with pytest.raises(RateLimited) as exc_info:
+                get_recommendations(["track1"])
+    assert exc_info.value.retry_after == 3
+
+
+def test_is_premium_user_is_cached_per_user(client):
+    with client.application.test_request_context():
+        session["spotify_token"] = "valid_token"
+        session["user_id"] = "premium_user"
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            mock_get.return_value = make_response(200, {"product": "premium"})
+            assert is_premium_user() is True
+            # Without the profile in the session only _premium_cache can answer
+            session.pop("cached_user_profile")
+            assert is_premium_user() is True
+    assert mock_get.call_count == 1
+
+
+def test_get_current_user_refetches_expired_profile(client):
+    with client.application.test_request_context():
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            mock_get.return_value = make_response(200, {"id": "u", "product": "free"})
+            assert get_current_user({})["product"] == "free"
+            assert get_current_user({})["product"] == "free"
+            assert mock_get.call_count == 1
+
+            session["cached_user_profile"]["fetched_at"] -= 301
+            mock_get.return_value = make_response(200, {"id": "u", "product": "premium"})
+            assert get_current_user({})["product"] == "premium"
+            assert mock_get.call_count == 2
+
+
+def test_token_bucket_allows_burst_then_throttles():
+    bucket = TokenBucket(rate=20, capacity=2)
+    start = time.monotonic()
+    bucket.acquire()
+    bucket.acquire()
+    assert time.monotonic() - start < 0.04
+    bucket.acquire()
+    assert time.monotonic() - start >= 0.04
+
+
+def test_spotify_get_json_reuses_body_on_304(client):
+    headers = {"Authorization": "Bearer etag_token"}
+    url = "https://api.spotify.com/v1/me"
+    with client.application.test_request_context():
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            mock_get.return_value = make_response(
+                200, {"id": "etag_user"}, headers={"ETag": '"v1"'}
+            )
+            assert spotify_get_json(url, headers)[1] == {"id": "etag_user"}
+
+            mock_get.return_value = make_response(304)
+            assert spotify_get_json(url, headers)[1] == {"id": "etag_user"}
+            assert mock_get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+
+
+def test_adapter_returns_last_5xx_response_after_retries(monkeypatch):
+    class AlwaysUnavailable(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), AlwaysUnavailable)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(Retry, "sleep", lambda self, response=None: None)
+
+    http = requests.Session()
+    http.mount("http://", _spotify_adapter)
+    try:
+        response = http.get(f"http://127.0.0.1:{server.server_port}/", timeout=5)
+    finally:
+        server.shutdown()
+    assert response.status_code == 503
+
+
+@pytest.mark.parametrize("status_code", [502, 200])
+def test_request_token_handles_non_json_body(status_code):
+    response = make_response(status_code)
+    response.content = b"<html>Bad Gateway</html>"
+    response.text = "<html>Bad Gateway</html>"
+    with patch("spotify.SPOTIFY_SESSION.post", return_value=response):
+        token_data, error = request_token({"grant_type": "refresh_token"})
+    assert token_data is None
+    assert error == "<html>Bad Gateway</html>"
+
+
+def test_concurrent_refreshes_send_one_token_request(client):
+    def slow_token_response(*args, **kwargs):
+        time.sleep(0.1)
+        return make_response(200, {"access_token": "fresh", "expires_in": 3600})
+
+    results = []
+
+    def refresh():
+        with client.application.test_request_context():
+            session["spotify_refresh_token"] = "shared_refresh_token"
+            results.append((refresh_spotify_token(), session["spotify_token"]))
+
+    with patch("spotify.SPOTIFY_SESSION.post", side_effect=slow_token_response) as mock_post:
+        threads = [threading.Thread(target=refresh) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert mock_post.call_count == 1
+    assert results == [(True, "fresh")] * 5
+
+
+def test_retried_callback_keeps_tokens_without_second_exchange(client):
+    token_response = make_response(
+        200, {"access_token": "token", "expires_in": 3600, "refresh_token": "r"}
+    )
+    with patch("spotify.SPOTIFY_SESSION.post", return_value=token_response) as mock_post, \
+            patch("spotify.SPOTIFY_SESSION.get", return_value=make_response(200, {"id": "u"})):
+        client.get("/spotify/spotify/callback?code=one_time_code")
+        response = client.get("/spotify/spotify/callback?code=one_time_code")
+
+    assert mock_post.call_count == 1
+    assert response.status_code == 302
+    assert response.location.endswith("/profile")
+    with client.session_transaction() as sess:
+        assert sess["spotify_token"] == "token"
+
+
+def test_replayed_callback_from_other_session_is_exchanged_again(client):
+    rejected = make_response(400, {"error": "invalid_grant"})
+    with client.session_transaction() as sess:
+        sess["spotify_auth_code"] = "someone_elses_code"
+    with client.application.test_client() as other_client, \
+            patch("spotify.SPOTIFY_SESSION.post", return_value=rejected) as mock_post:
+        other_client.get("/spotify/spotify/callback?code=someone_elses_code")
+        with other_client.session_transaction() as sess:
+            assert "spotify_token" not in sess
+    assert mock_post.call_count == 1
+
+
+def test_concurrent_callbacks_of_one_session_exchange_code_once():
+    app = Flask(__name__)
+    app.secret_key = "testkey"
+    # Server-side sessions have an ID, like the Redis sessions of the app
+    app.config["SESSION_TYPE"] = "cachelib"
+    app.config["SESSION_CACHELIB"] = SimpleCache()
+    Session(app)
+    app.register_blueprint(spotify_bp, url_prefix="/spotify")
+    app.add_url_rule("/profile", "profile", lambda: "Profile Page")
+
+    with app.test_client() as client:
+        with client.session_transaction() as sess:
+            sess["visited"] = True
+        session_cookie = client.get_cookie("session").value
+
+    def slow_token_response(*args, **kwargs):
+        time.sleep(0.1)
+        return make_response(200, {"access_token": "token", "expires_in": 3600})
+
+    statuses = []
+
+    def callback():
+        with app.test_client() as client:
+            client.set_cookie("session", session_cookie)
+            response = client.get("/spotify/spotify/callback?code=double_submitted_code")
+            statuses.append(response.location)
+
+    with patch("spotify.SPOTIFY_SESSION.post", side_effect=slow_token_response) as mock_post, \
+            patch("spotify.SPOTIFY_SESSION.get", return_value=make_response(200, {"id": "u"})):
+        threads = [threading.Thread(target=callback) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert mock_post.call_count == 1
+    assert all(location.endswith("/spotify/spotify/recommendations") for location in statuses)
+
+
+def test_get_recommendations_works_without_redis(client, redis_client):
+    def spotify_response(url, **kwargs):
+        if url.endswith("/tracks"):
+            return make_response(
+                200, {"tracks": [{"id": "seed", "artists": [{"id": "no_redis_artist"}]}]}
+            )
+        return make_response(200, {"tracks": [{"id": "rec1"}, {"id": "rec2"}]})
+
+    redis_client.get.side_effect = redis.TimeoutError("Timeout reading from socket")
+    redis_client.setex.side_effect = redis.ConnectionError("Connection refused")
+    with client.application.test_request_context():
+        session["spotify_token"] = "valid_token"
+        with patch("spotify.SPOTIFY_SESSION.get", side_effect=spotify_response):
+            tracks = get_recommendations(["seed"])
+            assert sorted(track["id"] for track in tracks) == ["rec1", "rec2"]
+            assert sorted(session["recommended_tracks"]) == ["rec1", "rec2"]
+
+
+def test_get_recommendations_uses_redis_cache(client, redis_client):
+    redis_client.get.return_value = orjson.dumps([{"id": "cached_rec"}])
+    with client.application.test_request_context():
+        session["spotify_token"] = "valid_token"
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            assert get_recommendations(["seed"]) == [{"id": "cached_rec"}]
+            assert session["recommended_tracks"] == ["cached_rec"]
+    mock_get.assert_not_called()
+
+
+def test_get_top_tracks_is_cached_per_user(client):
+    with client.application.test_request_context():
+        session["spotify_token"] = "valid_token"
+        session["user_id"] = "top_tracks_user"
+        with patch("spotify.SPOTIFY_SESSION.get") as mock_get:
+            mock_get.return_value = make_response(200, {"items": [{"id": "t1"}]})
+            assert get_top_tracks() == [{"id": "t1"}]
+            assert get_top_tracks() == [{"id": "t1"}]
+    assert mock_get.call_count == 1
+
+
+def test_clear_evicts_per_user_caches(client):
+    _premium_cache["cleared_user"] = True
+    _top_tracks_cache["cleared_user"] = ([{"id": "old"}], time.time())
+    with client.session_transaction() as sess:
+        sess["spotify_token"] = "valid_token"
+        sess["user_id"] = "cleared_user"
+
+    client.get("/spotify/clear")
+
+    assert "cleared_user" not in _premium_cache
+    assert "cleared_user" not in _top_tracks_cache